@@ -1,8 +1,26 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import openpyxl
-from datetime import datetime
+from openpyxl.utils import column_index_from_string
+from datetime import date, datetime, timedelta
+import io
+import logging
 import re
+import result_cache
+
+logger = logging.getLogger(__name__)
+
+# 抽出・計算処理のバージョン（結果が変わる変更をした場合に上げる）
+EXTRACTION_VERSION = 3
+
+# 列形式エクスポートのスキーマのバージョン（列を変更した場合に上げる）
+EXPORT_SCHEMA_VERSION = 1
+
+# 画面の再実行時に使う表などをメモリに残すファイル数の上限
+MEMORY_CACHE_MAX_ENTRIES = 32
 
 def main():
     st.set_page_config(
@@ -36,24 +54,30 @@ def overtime_tab():
     
     if uploaded_file is not None:
         try:
-            # エクセルファイルを読み込み（data_only=Trueで計算結果を取得）
-            workbook = openpyxl.load_workbook(uploaded_file, data_only=True)
-            sheet_names = workbook.sheetnames
+            # エクセルファイルを読み込み（同じファイルは休日・平日仕訳タブと抽出結果を共有）
+            file_bytes = uploaded_file.getvalue()
+            cache_key = result_cache.make_key(file_bytes, EXTRACTION_VERSION)
+            workbook_data = load_workbook_data(cache_key, file_bytes)
+            sheet_names = workbook_data['sheet_names']
             
             st.success(f"ファイルが正常に読み込まれました。シート数: {len(sheet_names)}")
             
             # 固定シートの確認
-            fixed_sheets = ["まとめ", "記入例", "報告書format", "残業代"]
-            member_sheets = [sheet for sheet in sheet_names if sheet not in fixed_sheets]
+            fixed_sheets, member_sheets = split_member_sheets(sheet_names)
             
             st.info(f"固定シート: {fixed_sheets}")
             st.info(f"メンバーシート: {member_sheets}")
             
+            # 処理できなかったシートのエラー（キャッシュから読み込んだ場合も表示）
+            for message in workbook_data['errors']:
+                st.warning(message)
+            
             if member_sheets:
                 # 残業時間の集計
-                overtime_data = extract_overtime_data(workbook, member_sheets)
+                overtime_data = workbook_data['overtime_data']
                 
                 if overtime_data:
+                    display_consistency_warnings(workbook_data['consistency'])
                     display_results(overtime_data)
                 else:
                     st.warning("残業時間のデータが見つかりませんでした。")
@@ -77,39 +101,51 @@ def holiday_tab():
     
     if uploaded_file is not None:
         try:
-            # エクセルファイルを読み込み（data_only=Trueで計算結果を取得）
-            workbook = openpyxl.load_workbook(uploaded_file, data_only=True)
-            sheet_names = workbook.sheetnames
+            # エクセルファイルを読み込み（同じファイルは残業時間集計タブと抽出結果を共有）
+            file_bytes = uploaded_file.getvalue()
+            # 表のキャッシュも抽出結果ではなくファイル内容のハッシュをキーにする
+            cache_key = result_cache.make_key(file_bytes, EXTRACTION_VERSION)
+            workbook_data = load_workbook_data(cache_key, file_bytes)
+            sheet_names = workbook_data['sheet_names']
             
             st.success(f"ファイルが正常に読み込まれました。シート数: {len(sheet_names)}")
             
             # 固定シートの確認
-            fixed_sheets = ["まとめ", "記入例", "報告書format", "残業代"]
-            member_sheets = [sheet for sheet in sheet_names if sheet not in fixed_sheets]
+            fixed_sheets, member_sheets = split_member_sheets(sheet_names)
             
             st.info(f"固定シート: {fixed_sheets}")
             st.info(f"メンバーシート: {member_sheets}")
             
+            # 処理できなかったシートのエラー（キャッシュから読み込んだ場合も表示）
+            for message in workbook_data['errors']:
+                st.warning(message)
+            
             if member_sheets:
                 # 休日・平日仕訳の集計
-                holiday_data = extract_holiday_data(workbook, member_sheets)
+                holiday_data = workbook_data['holiday_data']
                 
                 if holiday_data:
-                    display_holiday_results(holiday_data)
+                    display_consistency_warnings(workbook_data['consistency'])
+                    display_holiday_results(holiday_data, cache_key)
                     
                     # 残業代シートから単価を読み込み
-                    overtime_rates = read_overtime_sheet(workbook)
+                    overtime_rates = workbook_data['overtime_rates']
                     
                     if overtime_rates:
-                        # 残業代を計算
-                        pay_data = calculate_overtime_pay(holiday_data, overtime_rates)
+                        # 残業代を計算（読み込み時に計算済み）
+                        pay_data = workbook_data['pay_data']
                         
                         if pay_data:
-                            display_overtime_pay_results(pay_data, holiday_data)
+                            display_overtime_pay_results(pay_data, holiday_data, cache_key)
                         else:
                             st.warning("残業代の計算に失敗しました。")
                     else:
                         st.warning("残業代シートから単価データを読み込めませんでした。")
+                    
+                    # 分析用データ（単価がない場合は金額が空）
+                    display_export_download(
+                        cache_key, holiday_data, workbook_data['pay_data'], uploaded_file.name
+                    )
                 else:
                     st.warning("休日・平日仕訳のデータが見つかりませんでした。")
             else:
@@ -118,62 +154,195 @@ def holiday_tab():
         except Exception as e:
             st.error(f"ファイルの読み込み中にエラーが発生しました: {str(e)}")
 
-def extract_overtime_data(workbook, member_sheets):
-    """残業時間データを抽出する"""
+@st.cache_data(show_spinner=False, max_entries=MEMORY_CACHE_MAX_ENTRIES, ttl=60 * 60)
+def load_workbook_data(cache_key, _file_bytes):
+    """エクセルファイルを読み込み、両タブで使うデータをまとめて抽出する
+    
+    抽出結果と残業代の計算結果はディスクにも保存し、同じ内容のファイルは
+    他のプロセスやサーバー再起動後も再計算せずに返す。メモリには最近使った
+    ファイルの結果だけを残す（cache_key はファイル内容のハッシュ）。
+    """
+    return result_cache.get_or_compute(cache_key, lambda: process_workbook_bytes(_file_bytes))
+
+def process_workbook_bytes(file_bytes):
+    """エクセルファイルの内容から抽出と残業代の計算を行う"""
+    # data_only=Trueで計算結果を取得
+    workbook = openpyxl.load_workbook(io.BytesIO(file_bytes), data_only=True)
+    _, member_sheets = split_member_sheets(workbook.sheetnames)
+    
+    workbook_data = extract_member_data(workbook, member_sheets)
+    workbook_data['sheet_names'] = workbook.sheetnames
+    workbook_data['overtime_rates'] = read_overtime_sheet(workbook, workbook_data['errors'])
+    
+    # 残業代シートから単価を読み込めた場合のみ計算
+    if workbook_data['overtime_rates']:
+        workbook_data['pay_data'] = calculate_overtime_pay(
+            workbook_data['holiday_data'], workbook_data['overtime_rates']
+        )
+    else:
+        workbook_data['pay_data'] = {}
+    return workbook_data
+
+def split_member_sheets(sheet_names):
+    """シート名を固定シートとメンバーシートに分ける"""
+    fixed_sheets = ["まとめ", "記入例", "報告書format", "残業代"]
+    member_sheets = [sheet for sheet in sheet_names if sheet not in fixed_sheets]
+    return fixed_sheets, member_sheets
+
+def extract_member_data(workbook, member_sheets):
+    """メンバーシートを1回ずつ読み、残業時間集計と休日・平日仕訳のデータを抽出する
+    
+    39行目の合計（結合セルの場合は40行目）と8〜38行目の日ごとの時間を同じ走査で読み込み、
+    合計と日ごとの時間の和が一致しない時間帯を整合性チェックの結果として記録する。
+    処理できなかったシートのエラーは errors に記録する。
+    """
     overtime_data = {}
+    holiday_data = {}
+    consistency = {}
+    errors = []
     
     # 時間帯の定義
     time_slots = {
-        'K39': '休日時間帯の応動（09:00-18:00）',
-        'O39': '平日・休日時間外の応動（18:00-22:00）',
-        'S39': '平日・休日深夜の応動（22:00-05:00）',
-        'W39': '平日・休日時間外の応動（05:00-09:00）'
+        'K': '休日時間帯の応動（09:00-18:00）',
+        'O': '平日・休日時間外の応動（18:00-22:00）',
+        'S': '平日・休日深夜の応動（22:00-05:00）',
+        'W': '平日・休日時間外の応動（05:00-09:00）'
+    }
+    
+    # B列からW列までをまとめて読み込み、列番号を読み込み範囲内の位置に変換
+    first_column = column_index_from_string('B')
+    last_column = column_index_from_string('W')
+    positions = {
+        column: column_index_from_string(column) - first_column
+        for column in time_slots
     }
     
     for sheet_name in member_sheets:
         try:
             worksheet = workbook[sheet_name]
-            member_data = {}
             
-            for cell_ref, time_slot in time_slots.items():
-                # セルK39, O39, S39, W39の値を取得
-                cell_value = worksheet[cell_ref].value
+            # 8行目から40行目までを1回で読み込み
+            rows = list(worksheet.iter_rows(
+                min_row=8, max_row=40,
+                min_col=first_column, max_col=last_column,
+                values_only=True
+            ))
+            day_rows = rows[:31]  # 8〜38行目
+            total_row = rows[31]  # 39行目
+            next_row = rows[32]  # 40行目
+            
+            # 休日・平日の判定は時間帯に関係なく1行につき1回
+            day_flags = [None] * len(day_rows)
+            
+            member_overtime = {}
+            member_holiday = {}
+            member_consistency = {}
+            
+            for column, time_slot in time_slots.items():
+                position = positions[column]
                 
-                # 結合セルの場合、下のセル（K40, O40, S40, W40）も確認
+                # 39行目の合計（結合セルの場合、下のセルも確認）
+                cell_value = total_row[position]
                 if cell_value is None:
-                    # 結合セルの下のセルを確認
-                    next_cell_ref = cell_ref.replace('39', '40')
-                    cell_value = worksheet[next_cell_ref].value
+                    cell_value = next_row[position]
                 
+                total_hours = 0
                 if cell_value is not None:
+                    total_hours = parse_time_to_hours(cell_value)
+                
+                if total_hours > 0:
                     # 表示用の形式と集計用の数値を両方保存
-                    display_format = parse_time_to_display_format(cell_value)
-                    time_hours = parse_time_to_hours(cell_value)
-                    
-                    if time_hours > 0:
-                        member_data[time_slot] = {
-                            'display': display_format,
-                            'hours': time_hours
-                        }
-                    else:
-                        member_data[time_slot] = {
-                            'display': "",  # 空白セル
-                            'hours': 0
-                        }
+                    member_overtime[time_slot] = {
+                        'display': parse_time_to_display_format(cell_value),
+                        'hours': total_hours
+                    }
                 else:
-                    member_data[time_slot] = {
+                    member_overtime[time_slot] = {
                         'display': "",  # 空白セル
                         'hours': 0
                     }
+                
+                # 8〜38行目の日ごとの時間を休日・平日に仕訳
+                holiday_hours = 0
+                weekday_hours = 0
+                daily = []
+                
+                for index, values in enumerate(day_rows):
+                    time_value = values[position]
+                    
+                    # 時間が00:01以上の場合のみ処理
+                    if time_value is None:
+                        continue
+                    time_hours = parse_time_to_hours(time_value)
+                    # 00:01以上（約0.000694時間以上）の場合のみ処理
+                    if time_hours <= 0.000694:  # 1分 = 1/60/24 = 0.000694時間
+                        continue
+                    
+                    # B列の曜日情報とC列の祝日情報から休日・平日を判定
+                    day_value, holiday_value = values[0], values[1]
+                    if day_flags[index] is None:
+                        day_flags[index] = is_holiday_day(day_value, holiday_value)
+                    is_holiday = day_flags[index]
+                    
+                    if is_holiday:
+                        holiday_hours += time_hours
+                    else:
+                        weekday_hours += time_hours
+                    
+                    # 日ごとの単価参照用に日付と時間を保存
+                    daily.append({
+                        'date': parse_day_to_date(day_value),
+                        'is_holiday': is_holiday,
+                        'hours': time_hours
+                    })
+                
+                member_holiday[time_slot] = {
+                    'holiday_hours': holiday_hours,
+                    'weekday_hours': weekday_hours,
+                    'total_hours': holiday_hours + weekday_hours,
+                    'daily': daily
+                }
+                
+                # 合計と日ごとの時間の和が1分以上ずれている場合は不一致
+                daily_hours = holiday_hours + weekday_hours
+                member_consistency[time_slot] = {
+                    'total_hours': total_hours,
+                    'daily_hours': daily_hours,
+                    'consistent': abs(total_hours - daily_hours) < 1 / 60
+                }
             
             # 全メンバーを追加（データがなくても表示）
-            overtime_data[sheet_name] = member_data
+            overtime_data[sheet_name] = member_overtime
+            holiday_data[sheet_name] = member_holiday
+            consistency[sheet_name] = member_consistency
                 
         except Exception as e:
-            st.warning(f"シート '{sheet_name}' の処理中にエラーが発生しました: {str(e)}")
+            # 結果と一緒にキャッシュされるよう、表示せずにエラーとして記録
+            errors.append(f"シート '{sheet_name}' の処理中にエラーが発生しました: {str(e)}")
             continue
     
-    return overtime_data
+    return {
+        'overtime_data': overtime_data,
+        'holiday_data': holiday_data,
+        'consistency': consistency,
+        'errors': errors
+    }
+
+def display_consistency_warnings(consistency):
+    """39行目の合計と日ごとの時間が一致しない時間帯を表示する"""
+    mismatches = []
+    for member, data in consistency.items():
+        for time_slot, check in data.items():
+            if not check['consistent']:
+                total = format_hours(check['total_hours']) or "0:00"
+                daily = format_hours(check['daily_hours']) or "0:00"
+                mismatches.append(f"- {member}：{time_slot}（合計 {total} / 日ごと {daily}）")
+    
+    if mismatches:
+        st.warning(
+            "39行目の合計と8〜38行目の日ごとの時間が一致しない時間帯があります。\n\n"
+            + "\n".join(mismatches)
+        )
 
 def parse_time_to_display_format(time_value):
     """時間値を表示用の形式に変換する（1:30形式）"""
@@ -185,7 +354,7 @@ def parse_time_to_display_format(time_value):
         hours = time_value.hour
         minutes = time_value.minute
         result = f"{hours}:{minutes:02d}"
-        print(f"DEBUG: datetime.time {time_value} -> {result}")
+        logger.debug(f"datetime.time {time_value} -> {result}")
         return result
     
     # 文字列の場合
@@ -204,10 +373,10 @@ def parse_time_to_display_format(time_value):
                 if hours == 0 and minutes == 0:
                     return ""  # 空白セル
                 result = f"{hours}:{minutes:02d}"
-                print(f"DEBUG: 時間文字列 {time_str} -> {result}")
+                logger.debug(f"時間文字列 {time_str} -> {result}")
                 return result
         except Exception as e:
-            print(f"DEBUG: パースエラー {time_str}: {e}")
+            logger.debug(f"パースエラー {time_str}: {e}")
             pass
     
     # 数値の場合（エクセルの時間値は小数で表現される）
@@ -221,7 +390,7 @@ def parse_time_to_display_format(time_value):
             if hours == 0 and minutes == 0:
                 return ""  # 空白セル
             result = f"{hours}:{minutes:02d}"
-            print(f"DEBUG: エクセル時間値 {time_value} -> {result}")
+            logger.debug(f"エクセル時間値 {time_value} -> {result}")
             return result
         else:
             # 数値として認識された場合
@@ -232,7 +401,7 @@ def parse_time_to_display_format(time_value):
             if hours == 0 and minutes == 0:
                 return ""  # 空白セル
             result = f"{hours}:{minutes:02d}"
-            print(f"DEBUG: 数値として認識 {time_str} -> {result}")
+            logger.debug(f"数値として認識 {time_str} -> {result}")
             return result
     except:
         # 文字列から数値を抽出
@@ -246,9 +415,9 @@ def parse_time_to_display_format(time_value):
             if hours == 0 and minutes == 0:
                 return ""  # 空白セル
             result = f"{hours}:{minutes:02d}"
-            print(f"DEBUG: 文字列から数値抽出 {time_str} -> {result}")
+            logger.debug(f"文字列から数値抽出 {time_str} -> {result}")
             return result
-        print(f"DEBUG: 認識できない形式 {time_str}")
+        logger.debug(f"認識できない形式 {time_str}")
         return ""  # 空白セル
 
 def parse_time_to_hours(time_value):
@@ -313,68 +482,6 @@ def parse_time_to_hours(time_value):
             return result
         return 0
 
-def extract_holiday_data(workbook, member_sheets):
-    """休日・平日仕訳データを抽出する"""
-    holiday_data = {}
-    
-    # 時間帯の定義
-    time_slots = {
-        'K': '休日時間帯の応動（09:00-18:00）',
-        'O': '平日・休日時間外の応動（18:00-22:00）',
-        'S': '平日・休日深夜の応動（22:00-05:00）',
-        'W': '平日・休日時間外の応動（05:00-09:00）'
-    }
-    
-    for sheet_name in member_sheets:
-        try:
-            worksheet = workbook[sheet_name]
-            member_data = {}
-            
-            for column, time_slot in time_slots.items():
-                holiday_hours = 0
-                weekday_hours = 0
-                
-                # 8行目から38行目までチェック
-                for row in range(8, 39):
-                    # 時間セル（K8, O8, S8, W8など）
-                    time_cell = f"{column}{row}"
-                    time_value = worksheet[time_cell].value
-                    
-                    # 時間が00:01以上の場合のみ処理
-                    if time_value is not None:
-                        time_hours = parse_time_to_hours(time_value)
-                        # 00:01以上（約0.000694時間以上）の場合のみ処理
-                        if time_hours > 0.000694:  # 1分 = 1/60/24 = 0.000694時間
-                            # B列の曜日情報を取得（DATE関数の結果を取得）
-                            day_cell = f"B{row}"
-                            day_value = worksheet[day_cell].value
-                            
-                            # C列の祝日情報を取得
-                            holiday_cell = f"C{row}"
-                            holiday_value = worksheet[holiday_cell].value
-                            
-                            # 休日・平日の判定
-                            is_holiday = is_holiday_day(day_value, holiday_value)
-                            
-                            if is_holiday:
-                                holiday_hours += time_hours
-                            else:
-                                weekday_hours += time_hours
-                
-                member_data[time_slot] = {
-                    'holiday_hours': holiday_hours,
-                    'weekday_hours': weekday_hours,
-                    'total_hours': holiday_hours + weekday_hours
-                }
-            
-            holiday_data[sheet_name] = member_data
-                
-        except Exception as e:
-            st.warning(f"シート '{sheet_name}' の処理中にエラーが発生しました: {str(e)}")
-            continue
-    
-    return holiday_data
-
 def is_holiday_day(day_value, holiday_value):
     """曜日と祝日情報から休日かどうかを判定する"""
     if day_value is None:
@@ -436,44 +543,136 @@ def is_holiday_day(day_value, holiday_value):
     
     return False
 
-def display_holiday_results(holiday_data):
-    """休日・平日仕訳結果を表示する"""
-    st.markdown("## 📅 休日・平日仕訳結果")
+def parse_day_to_date(day_value):
+    """日付セルの値をdateに変換する（日付として解釈できない場合はNone）"""
+    if day_value is None:
+        return None
+    
+    # datetimeオブジェクトの場合
+    if isinstance(day_value, datetime):
+        return day_value.date()
+    
+    # dateオブジェクトの場合
+    if hasattr(day_value, 'weekday') and hasattr(day_value, 'year'):
+        return day_value
+    
+    # エクセルの日付シリアル値の場合
+    if isinstance(day_value, (int, float)) and not isinstance(day_value, bool):
+        try:
+            base_date = datetime(1899, 12, 30)  # エクセルの基準日
+            return (base_date + timedelta(days=int(day_value))).date()
+        except (OverflowError, ValueError):
+            return None
+    
+    # 文字列の場合（「月」などの曜日表記は日付なしとして扱う）
+    day_str = str(day_value).strip()
+    if not re.search(r'\d', day_str):
+        return None
+    parsed = pd.to_datetime(day_str, errors='coerce')
+    if pd.isna(parsed):
+        return None
+    return parsed.date()
+
+def build_holiday_results_frame(holiday_data):
+    """休日・平日仕訳結果の表を作成する（時間は数値のまま保持）"""
+    time_slots = [
+        '休日時間帯の応動（09:00-18:00）',
+        '平日・休日時間外の応動（18:00-22:00）',
+        '平日・休日深夜の応動（22:00-05:00）',
+        '平日・休日時間外の応動（05:00-09:00）'
+    ]
     
-    # データフレームを作成（指定された形式）
     df_data = []
     for member, data in holiday_data.items():
         row = {'メンバー': member}
         
         # 各時間帯の休日・平日時間を追加
-        time_slots = [
-            '休日時間帯の応動（09:00-18:00）',
-            '平日・休日時間外の応動（18:00-22:00）',
-            '平日・休日深夜の応動（22:00-05:00）',
-            '平日・休日時間外の応動（05:00-09:00）'
-        ]
-        
         for time_slot in time_slots:
             if time_slot in data:
                 time_data = data[time_slot]
                 # 休日時間
-                row[f'{time_slot}_休日'] = format_hours(time_data['holiday_hours'])
+                row[f'{time_slot}_休日'] = float(time_data['holiday_hours'])
                 # 平日時間
-                row[f'{time_slot}_平日'] = format_hours(time_data['weekday_hours'])
+                row[f'{time_slot}_平日'] = float(time_data['weekday_hours'])
             else:
-                row[f'{time_slot}_休日'] = ""
-                row[f'{time_slot}_平日'] = ""
+                row[f'{time_slot}_休日'] = None
+                row[f'{time_slot}_平日'] = None
         
         df_data.append(row)
     
-    if df_data:
-        df = pd.DataFrame(df_data)
+    return pd.DataFrame(df_data)
+
+# 以下のキャッシュは、画面の再実行のたびに抽出結果や表の内容をハッシュしないよう
+# ファイル内容のハッシュ（cache_key）だけをキーにする（_で始まる引数はキーに含まれない）
+
+@st.cache_data(show_spinner=False, max_entries=MEMORY_CACHE_MAX_ENTRIES)
+def load_holiday_results_frame(cache_key, _holiday_data):
+    """休日・平日仕訳結果の表を作成する（画面の再実行時はキャッシュを使用）"""
+    return build_holiday_results_frame(_holiday_data)
+
+@st.cache_data(show_spinner=False, max_entries=MEMORY_CACHE_MAX_ENTRIES)
+def load_overtime_pay_frame(cache_key, _pay_data, _holiday_data):
+    """残業代計算結果の表を作成する（画面の再実行時はキャッシュを使用）"""
+    return build_overtime_pay_frame(_pay_data, _holiday_data)
+
+@st.cache_data(show_spinner=False, max_entries=MEMORY_CACHE_MAX_ENTRIES)
+def dataframe_to_csv(cache_key, table_name, _df, _formatters):
+    """表示と同じ形式に整形してCSV文字列を作成する（ファイルと表の種類ごとにキャッシュ）"""
+    formatted = _df.copy()
+    for column, formatter in _formatters.items():
+        formatted[column] = [
+            "" if pd.isna(value) else formatter(value) for value in _df[column]
+        ]
+    return formatted.to_csv(index=False, encoding='utf-8-sig')
+
+def display_result_table(df, formatters, key):
+    """結果の表を表示する（大きな表はページに分け、表示する行だけを整形する）"""
+    page_size = 100
+    
+    if len(df) > page_size:
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            sort_column = st.selectbox("並び替え", list(df.columns), key=f"{key}_sort")
+        
+        with col2:
+            descending = st.checkbox("降順", key=f"{key}_descending")
+        
+        # 並び替えは数値のまま全行に対して行う
+        df = df.sort_values(sort_column, ascending=not descending, kind='stable')
+        
+        with col3:
+            page_count = (len(df) - 1) // page_size + 1
+            page = st.number_input(
+                f"ページ（全{page_count}ページ）",
+                min_value=1,
+                max_value=page_count,
+                value=1,
+                step=1,
+                key=f"{key}_page"
+            )
+        
+        start = (page - 1) * page_size
+        df = df.iloc[start:start + page_size]
+    
+    st.dataframe(df.style.format(formatters, na_rep=""), use_container_width=True)
+
+def display_holiday_results(holiday_data, cache_key):
+    """休日・平日仕訳結果を表示する"""
+    st.markdown("## 📅 休日・平日仕訳結果")
+    
+    # データフレームを作成（指定された形式）
+    df = load_holiday_results_frame(cache_key, holiday_data)
+    
+    if not df.empty:
+        # 時間列は表示時に「1:30」形式に整形
+        formatters = {column: format_hours for column in df.columns[1:]}
         
         # 表示
-        st.dataframe(df, use_container_width=True)
+        display_result_table(df, formatters, key="holiday_results")
         
         # ダウンロードボタン
-        csv = df.to_csv(index=False, encoding='utf-8-sig')
+        csv = dataframe_to_csv(cache_key, "holiday_results", df, formatters)
         st.download_button(
             label="📥 CSVファイルとしてダウンロード",
             data=csv,
@@ -514,6 +713,18 @@ def format_hours(hours):
     m = int((hours - h) * 60)
     return f"{h}:{m:02d}"
 
+def format_decimal_hours(hours):
+    """稼働時間を表示用の形式に変換する（0.0の場合は空白）"""
+    if hours <= 0:
+        return ""
+    return f"{hours:.1f}"
+
+def format_yen(amount):
+    """金額を表示用の形式に変換する（¥0の場合は空白）"""
+    if amount <= 0:
+        return ""
+    return f"¥{amount:,.0f}"
+
 def hours_to_decimal(hours):
     """時間を小数形式に変換する（1:30 → 1.5）"""
     if hours == 0:
@@ -523,13 +734,18 @@ def hours_to_decimal(hours):
     m = int((hours - h) * 60)
     return h + m / 60
 
-def read_overtime_sheet(workbook):
-    """残業代シートからメンバー名と単価を読み込む"""
+def read_overtime_sheet(workbook, errors=None):
+    """残業代シートからメンバー名と単価を読み込む
+    
+    H列に適用開始日がある行は、その日以降に適用される単価として扱う。
+    同じメンバーの行を複数記入することで月途中の単価変更に対応する。
+    日付として読み込めない適用開始日は適用開始日なしとして扱い、errors に記録する。
+    """
     if "残業代" not in workbook.sheetnames:
         return {}
     
     worksheet = workbook["残業代"]
-    member_data = {}
+    rate_rows = {}
     
     # C30から空白セルが来るまで読み込み
     row = 30
@@ -551,16 +767,100 @@ def read_overtime_sheet(workbook):
         rate_f = worksheet[cell_f].value or 0
         rate_g = worksheet[cell_g].value or 0
         
-        member_data[str(member_name).strip()] = {
+        # H列の適用開始日を取得（空白の場合は期間の指定なし）
+        cell_h = f"H{row}"
+        value_h = worksheet[cell_h].value
+        effective_from = parse_effective_date(value_h)
+        if effective_from is None and value_h is not None and str(value_h).strip() != "":
+            if errors is not None:
+                errors.append(
+                    f"残業代シート {cell_h} の適用開始日 '{value_h}' を日付として読み込めないため、"
+                    "適用開始日なしとして扱いました"
+                )
+        
+        rate_rows.setdefault(str(member_name).strip(), []).append({
+            'start': effective_from,
             'D': float(rate_d) if rate_d else 0,
             'E': float(rate_e) if rate_e else 0,
             'F': float(rate_f) if rate_f else 0,
             'G': float(rate_g) if rate_g else 0
-        }
+        })
         
         row += 1
     
-    return member_data
+    return {name: build_rate_table(rows) for name, rows in rate_rows.items()}
+
+def parse_effective_date(value):
+    """適用開始日のセルの値をdateに変換する（日付セル以外や扱えない範囲の日付はNone）"""
+    # 数値や文字列は単価などの誤入力の可能性があるため、日付セルのみ受け付ける
+    if isinstance(value, datetime):
+        value = value.date()
+    elif not isinstance(value, date):
+        return None
+    
+    # pandasの日時で扱える範囲外の日付は単価表を作成できない
+    if not pd.Timestamp.min.date() < value <= pd.Timestamp.max.date():
+        return None
+    return value
+
+def build_rate_table(rate_rows):
+    """単価行から適用期間の区間インデックスを持つ単価表を作成する"""
+    rate_table = pd.DataFrame(rate_rows, columns=['start', 'D', 'E', 'F', 'G'])
+    
+    # 適用開始日がない行は最初から適用される単価として扱う
+    rate_table['start'] = [
+        pd.Timestamp(start) if start is not None else pd.Timestamp.min
+        for start in rate_table['start']
+    ]
+    
+    # 同じ適用開始日の行は後に記入された行を優先
+    rate_table = rate_table.drop_duplicates('start', keep='last')
+    rate_table = rate_table.sort_values('start', kind='stable')
+    
+    # 各行の適用期間は次の行の適用開始日の前日まで
+    starts = pd.DatetimeIndex(rate_table['start'])
+    ends = starts[1:].append(pd.DatetimeIndex([pd.Timestamp.max]))
+    rate_table.index = pd.IntervalIndex.from_arrays(starts, ends, closed='left')
+    
+    return rate_table[['D', 'E', 'F', 'G']]
+
+def to_day_numbers(dates):
+    """日付の配列を検索用の通し日数に変換する（日付なし・適用開始日なしは0、それ以外は1以上）"""
+    timestamps = pd.to_datetime(pd.Series(dates, dtype=object))
+    
+    # pd.Timestamp.min（適用開始日なし）は日単位への変換で桁あふれするため変換前に除く
+    undated = (timestamps.isna() | (timestamps == pd.Timestamp.min)).to_numpy()
+    dated = timestamps.where(~undated, pd.Timestamp('1970-01-01'))
+    days = dated.to_numpy().astype('datetime64[D]').astype(np.int64)
+    
+    # pandasで扱える最初の日を1とする通し日数
+    first_day = np.datetime64(pd.Timestamp.min.date(), 'D').astype(np.int64)
+    day_numbers = np.maximum(days - first_day + 1, 1)
+    day_numbers[undated] = 0
+    return day_numbers
+
+def lookup_rate_rows(rate_tables, member_codes, dates):
+    """日ごとに適用される単価表の行番号を全メンバー分まとめて検索する"""
+    # メンバー番号と適用開始日を1つのキーにまとめ、ソート済み配列で検索する
+    key_scale = 10 ** 6
+    segment_starts = np.zeros(len(rate_tables), dtype=np.int64)
+    table_keys = []
+    offset = 0
+    for member_code, rate_table in enumerate(rate_tables):
+        segment_starts[member_code] = offset
+        table_keys.append(member_code * key_scale + to_day_numbers(rate_table.index.left))
+        offset += len(rate_table)
+    table_keys = np.concatenate(table_keys)
+    assert np.all(np.diff(table_keys) > 0), "単価表の検索キーがソートされていません"
+    
+    member_codes = np.asarray(member_codes, dtype=np.int64)
+    day_keys = member_codes * key_scale + to_day_numbers(dates)
+    positions = np.searchsorted(table_keys, day_keys, side='right') - 1
+    
+    # 最初の適用開始日より前の日と日付不明の日はメンバーの最初の単価を使う
+    member_starts = segment_starts[member_codes]
+    positions = np.maximum(positions, member_starts)
+    return positions - member_starts
 
 def match_member_name(full_name, sheet_names):
     """フルネームとシート名を照合する"""
@@ -570,88 +870,101 @@ def match_member_name(full_name, sheet_names):
     return None
 
 def calculate_overtime_pay(holiday_data, overtime_rates):
-    """残業代を計算する"""
+    """残業代を計算する（日ごとにその日に適用される単価を使用）"""
     pay_data = {}
     
+    # 時間帯ごとの単価列（休日, 平日）
+    # 休日時間帯の応動（09:00-18:00）休日*F列（平日なし）
+    # 平日・休日時間外の応動（18:00-22:00）休日*F列、平日*D列
+    # 平日・休日深夜の応動（22:00-05:00）休日*G列、平日*E列
+    # 平日・休日時間外の応動（05:00-09:00）休日*G列、平日*E列
+    rate_columns = {
+        '休日時間帯の応動（09:00-18:00）': ('F', None),
+        '平日・休日時間外の応動（18:00-22:00）': ('F', 'D'),
+        '平日・休日深夜の応動（22:00-05:00）': ('G', 'E'),
+        '平日・休日時間外の応動（05:00-09:00）': ('G', 'E')
+    }
+    
+    rate_tables = []
+    day_records = []
+    
     for member, data in holiday_data.items():
         # メンバー名とシート名の照合
-        matched_sheet = None
+        member_rates = None
         for full_name, rates in overtime_rates.items():
             if match_member_name(full_name, [member]):
-                matched_sheet = member
                 member_rates = rates
                 break
         
-        if not matched_sheet:
+        if member_rates is None:
             continue
         
+        member_code = len(rate_tables)
+        rate_tables.append(member_rates)
         member_pay = {}
         
-        # 各時間帯の残業代を計算
-        time_slots = [
-            '休日時間帯の応動（09:00-18:00）',
-            '平日・休日時間外の応動（18:00-22:00）',
-            '平日・休日深夜の応動（22:00-05:00）',
-            '平日・休日時間外の応動（05:00-09:00）'
-        ]
-        
-        for time_slot in time_slots:
+        for time_slot in rate_columns:
             if time_slot in data:
-                time_data = data[time_slot]
-                holiday_hours = hours_to_decimal(time_data['holiday_hours'])
-                weekday_hours = hours_to_decimal(time_data['weekday_hours'])
-                
-                # 単価の組み合わせで計算
-                if time_slot == '休日時間帯の応動（09:00-18:00）':
-                    # 休日時間帯の応動（09:00-18:00）休日*F列
-                    holiday_pay = holiday_hours * member_rates['F']
-                    weekday_pay = 0  # この時間帯は平日なし
-                elif time_slot == '平日・休日時間外の応動（18:00-22:00）':
-                    # 平日・休日時間外の応動（18:00-22:00）休日*F列
-                    # 平日・休日時間外の応動（18:00-22:00）平日*D列
-                    holiday_pay = holiday_hours * member_rates['F']
-                    weekday_pay = weekday_hours * member_rates['D']
-                elif time_slot == '平日・休日深夜の応動（22:00-05:00）':
-                    # 平日・休日深夜の応動（22:00-05:00）休日*G列
-                    # 平日・休日深夜の応動（22:00-05:00）平日*E列
-                    holiday_pay = holiday_hours * member_rates['G']
-                    weekday_pay = weekday_hours * member_rates['E']
-                elif time_slot == '平日・休日時間外の応動（05:00-09:00）':
-                    # 平日・休日時間外の応動（05:00-09:00）休日*G列
-                    # 平日・休日時間外の応動（05:00-09:00）平日*E列
-                    holiday_pay = holiday_hours * member_rates['G']
-                    weekday_pay = weekday_hours * member_rates['E']
-                else:
-                    holiday_pay = 0
-                    weekday_pay = 0
-                
                 member_pay[time_slot] = {
-                    'holiday_pay': holiday_pay,
-                    'weekday_pay': weekday_pay,
-                    'total_pay': holiday_pay + weekday_pay
+                    'holiday_pay': 0,
+                    'weekday_pay': 0,
+                    'total_pay': 0
                 }
+                for day in data[time_slot].get('daily', []):
+                    day_records.append((
+                        member, member_code, time_slot,
+                        day['is_holiday'], day['date'], day['hours']
+                    ))
         
         pay_data[member] = member_pay
     
+    if not day_records:
+        return pay_data
+    
+    # 全メンバーの日ごとの単価行をまとめて検索
+    days = pd.DataFrame(
+        day_records,
+        columns=['member', 'member_code', 'time_slot', 'is_holiday', 'date', 'hours']
+    )
+    days['rate_row'] = lookup_rate_rows(rate_tables, days['member_code'], days['date'])
+    
+    # 同じ単価が適用される日の時間を合計してから計算
+    # （稼働時間の列と同じ結果になるよう、抽出時と同じ順序で1日ずつ足し合わせる）
+    grouped = {}
+    for record in zip(
+        days['member'], days['member_code'], days['time_slot'],
+        days['is_holiday'], days['rate_row'], days['hours']
+    ):
+        key = record[:5]
+        grouped[key] = grouped.get(key, 0) + record[5]
+    
+    for (member, member_code, time_slot, is_holiday, rate_row), hours in grouped.items():
+        holiday_column, weekday_column = rate_columns[time_slot]
+        rate_column = holiday_column if is_holiday else weekday_column
+        if rate_column is None:
+            continue
+        
+        pay = hours_to_decimal(hours) * float(rate_tables[member_code].iloc[rate_row][rate_column])
+        slot_pay = pay_data[member][time_slot]
+        slot_pay['holiday_pay' if is_holiday else 'weekday_pay'] += pay
+        slot_pay['total_pay'] += pay
+    
     return pay_data
 
-def display_overtime_pay_results(pay_data, holiday_data):
-    """残業代計算結果を表示する"""
-    st.markdown("## 💰 残業代計算結果")
+def build_overtime_pay_frame(pay_data, holiday_data):
+    """残業代計算結果の表を作成する（稼働時間と請求額は数値のまま保持）"""
+    time_slots = [
+        '休日時間帯の応動（09:00-18:00）',
+        '平日・休日時間外の応動（18:00-22:00）',
+        '平日・休日深夜の応動（22:00-05:00）',
+        '平日・休日時間外の応動（05:00-09:00）'
+    ]
     
-    # データフレームを作成（指定された形式）
     df_data = []
     for member, data in pay_data.items():
         row = {'メンバー': member}
         
         # 稼働時間と請求額を計算
-        time_slots = [
-            '休日時間帯の応動（09:00-18:00）',
-            '平日・休日時間外の応動（18:00-22:00）',
-            '平日・休日深夜の応動（22:00-05:00）',
-            '平日・休日時間外の応動（05:00-09:00）'
-        ]
-        
         total_work_hours = 0
         total_pay = 0
         
@@ -668,60 +981,53 @@ def display_overtime_pay_results(pay_data, holiday_data):
                 pay_amount = time_data['holiday_pay'] + time_data['weekday_pay']
                 total_pay += pay_amount
                 
-                # 稼働時間列（0.0の場合は空白）
-                if work_hours > 0:
-                    row[f'稼働：{time_slot}'] = f"{work_hours:.1f}"
-                else:
-                    row[f'稼働：{time_slot}'] = ""
-                
-                # 請求額列（¥0の場合は空白）
-                if pay_amount > 0:
-                    row[f'請求：{time_slot}'] = f"¥{pay_amount:,.0f}"
-                else:
-                    row[f'請求：{time_slot}'] = ""
+                row[f'稼働：{time_slot}'] = float(work_hours)
+                row[f'請求：{time_slot}'] = float(pay_amount)
             else:
-                row[f'稼働：{time_slot}'] = ""
-                row[f'請求：{time_slot}'] = ""
+                row[f'稼働：{time_slot}'] = None
+                row[f'請求：{time_slot}'] = None
         
-        # 総稼働時間と総請求額（0の場合は空白）
-        if total_work_hours > 0:
-            row['稼働時間'] = f"{total_work_hours:.1f}"
-        else:
-            row['稼働時間'] = ""
-        
-        if total_pay > 0:
-            row['請求額'] = f"¥{total_pay:,.0f}"
-        else:
-            row['請求額'] = ""
+        # 総稼働時間と総請求額
+        row['稼働時間'] = float(total_work_hours)
+        row['請求額'] = float(total_pay)
         
         df_data.append(row)
     
-    if df_data:
-        df = pd.DataFrame(df_data)
-        
-        # 列の順序を指定（稼働4つ左側、請求4つ右側）
-        columns_order = [
-            'メンバー',
-            '稼働：休日時間帯の応動（09:00-18:00）',
-            '稼働：平日・休日時間外の応動（18:00-22:00）',
-            '稼働：平日・休日深夜の応動（22:00-05:00）',
-            '稼働：平日・休日時間外の応動（05:00-09:00）',
-            '請求：休日時間帯の応動（09:00-18:00）',
-            '請求：平日・休日時間外の応動（18:00-22:00）',
-            '請求：平日・休日深夜の応動（22:00-05:00）',
-            '請求：平日・休日時間外の応動（05:00-09:00）',
-            '稼働時間',
-            '請求額'
-        ]
-        
-        # 列の順序を適用
-        df = df[columns_order]
+    if not df_data:
+        return pd.DataFrame()
+    
+    # 列の順序を指定（稼働4つ左側、請求4つ右側）
+    columns_order = (
+        ['メンバー']
+        + [f'稼働：{time_slot}' for time_slot in time_slots]
+        + [f'請求：{time_slot}' for time_slot in time_slots]
+        + ['稼働時間', '請求額']
+    )
+    
+    # 列の順序を適用
+    return pd.DataFrame(df_data)[columns_order]
+
+def display_overtime_pay_results(pay_data, holiday_data, cache_key):
+    """残業代計算結果を表示する"""
+    st.markdown("## 💰 残業代計算結果")
+    
+    # データフレームを作成（指定された形式）
+    df = load_overtime_pay_frame(cache_key, pay_data, holiday_data)
+    
+    if not df.empty:
+        # 稼働時間・請求額は表示時に整形（0の場合は空白）
+        formatters = {}
+        for column in df.columns[1:]:
+            if column.startswith('請求'):
+                formatters[column] = format_yen
+            else:
+                formatters[column] = format_decimal_hours
         
         # 表示
-        st.dataframe(df, use_container_width=True)
+        display_result_table(df, formatters, key="overtime_pay_results")
         
         # ダウンロードボタン
-        csv = df.to_csv(index=False, encoding='utf-8-sig')
+        csv = dataframe_to_csv(cache_key, "overtime_pay_results", df, formatters)
         st.download_button(
             label="📥 CSVファイルとしてダウンロード",
             data=csv,
@@ -750,6 +1056,81 @@ def display_overtime_pay_results(pay_data, holiday_data):
             avg_pay = total_pay / len(pay_data) if pay_data else 0
             st.metric("平均請求額", f"¥{avg_pay:,.0f}")
 
+def get_period(holiday_data):
+    """日ごとのデータから対象期間（YYYY-MM）を求める（日付がない場合はNone）"""
+    dates = [
+        day['date']
+        for data in holiday_data.values()
+        for time_data in data.values()
+        for day in time_data.get('daily', [])
+        if day['date'] is not None
+    ]
+    if not dates:
+        return None
+    return min(dates).strftime('%Y-%m')
+
+def export_schema():
+    """列形式エクスポートのスキーマ"""
+    dictionary_string = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [
+            pa.field('workbook', dictionary_string),
+            pa.field('period', pa.string()),
+            pa.field('member', dictionary_string),
+            pa.field('time_slot', dictionary_string),
+            pa.field('day_type', dictionary_string),
+            pa.field('minutes', pa.int32()),
+            pa.field('pay', pa.float64()),
+            pa.field('schema_version', pa.int16())
+        ],
+        metadata={'schema_version': str(EXPORT_SCHEMA_VERSION)}
+    )
+
+def build_export_table(holiday_data, pay_data, workbook_name):
+    """メンバー×時間帯×休日・平日ごとに1行の列形式の表を作成する"""
+    period = get_period(holiday_data)
+    
+    # 休日・平日ごとの時間と金額のキー
+    day_types = [
+        ('休日', 'holiday_hours', 'holiday_pay'),
+        ('平日', 'weekday_hours', 'weekday_pay')
+    ]
+    
+    columns = {name: [] for name in export_schema().names}
+    for member, data in holiday_data.items():
+        member_pay = pay_data.get(member, {})
+        for time_slot, time_data in data.items():
+            slot_pay = member_pay.get(time_slot)
+            for day_type, hours_key, pay_key in day_types:
+                columns['workbook'].append(workbook_name)
+                columns['period'].append(period)
+                columns['member'].append(member)
+                columns['time_slot'].append(time_slot)
+                columns['day_type'].append(day_type)
+                columns['minutes'].append(int(round(time_data[hours_key] * 60)))
+                # 単価がないメンバーの金額は空（null）
+                columns['pay'].append(float(slot_pay[pay_key]) if slot_pay else None)
+                columns['schema_version'].append(EXPORT_SCHEMA_VERSION)
+    
+    return pa.Table.from_pydict(columns, schema=export_schema())
+
+@st.cache_data(show_spinner=False, max_entries=MEMORY_CACHE_MAX_ENTRIES)
+def export_to_parquet(cache_key, workbook_name, _holiday_data, _pay_data):
+    """列形式の表をParquet形式のバイト列に変換する（ファイル内容のハッシュとファイル名でキャッシュ）"""
+    buffer = io.BytesIO()
+    pq.write_table(build_export_table(_holiday_data, _pay_data, workbook_name), buffer)
+    return buffer.getvalue()
+
+def display_export_download(cache_key, holiday_data, pay_data, workbook_name):
+    """分析用の列形式データのダウンロードボタンを表示する"""
+    st.download_button(
+        label="📥 Parquetファイルとしてダウンロード（分析用）",
+        data=export_to_parquet(cache_key, workbook_name, holiday_data, pay_data),
+        file_name=f"残業集計_{datetime.now().strftime('%Y%m%d_%H%M%S')}.parquet",
+        mime="application/vnd.apache.parquet",
+        help="メンバー×時間帯×休日・平日ごとに、分数と金額を数値のまま出力します"
+    )
+
 def display_results(overtime_data):
     """結果を表示する"""
     st.markdown("## 📈 残業時間集計結果")
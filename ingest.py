@@ -0,0 +1,388 @@
+"""監視フォルダに置かれたエクセルファイルを自動で集計する常駐処理
+
+使い方:
+    python ingest.py --watch-dir 受信フォルダ --output-dir 集計結果
+
+新規・変更された.xlsxファイルだけを集計し、結果を出力フォルダに保存する。
+集計済みの全ファイルをまとめた結果は consolidated_*.csv に、分析用の列形式の結果は
+dataset/ 以下に期間ごとに分割したParquetデータセットとして出力される。
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from streamlit.logger import get_logger
+
+# 画面なしで実行するため、app読み込み時のキャッシュの警告（実行環境なし）は表示しない
+get_logger("streamlit.runtime.caching.cache_data_api").setLevel(logging.ERROR)
+
+from app import (
+    split_member_sheets,
+    extract_member_data,
+    read_overtime_sheet,
+    calculate_overtime_pay,
+    build_holiday_results_frame,
+    build_overtime_pay_frame,
+    build_export_table
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数を読み込む（環境変数でも指定可能）"""
+    parser = argparse.ArgumentParser(description="監視フォルダのエクセルファイルを自動で集計する")
+    parser.add_argument(
+        "--watch-dir",
+        default=os.environ.get("INGEST_WATCH_DIR"),
+        help="監視するフォルダ（環境変数 INGEST_WATCH_DIR）"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=os.environ.get("INGEST_OUTPUT_DIR"),
+        help="集計結果を保存するフォルダ（環境変数 INGEST_OUTPUT_DIR）"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=float(os.environ.get("INGEST_INTERVAL", 10)),
+        help="監視フォルダを確認する間隔（秒）"
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=float(os.environ.get("INGEST_SETTLE", 30)),
+        help="書き込み中とみなさないために、サイズと更新日時が変わらずに経過すべき秒数"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("INGEST_WORKERS", 2)),
+        help="同時に集計するファイル数の上限"
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="1回だけ確認して終了する（書き込み待ちは行わない）"
+    )
+    args = parser.parse_args()
+
+    if not args.watch_dir or not args.output_dir:
+        parser.error("--watch-dir と --output-dir を指定してください")
+
+    return args
+
+
+def file_hash(path):
+    """ファイル内容のSHA-256を計算する"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(path, data):
+    """一時ファイルに書き込んでから置き換える（読み込み側が途中の内容を見ないように）"""
+    temp_path = f"{path}.tmp"
+    mode = "wb" if isinstance(data, bytes) else "w"
+    encoding = None if isinstance(data, bytes) else "utf-8"
+    with open(temp_path, mode, encoding=encoding) as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def write_csv(path, df):
+    """エクセルで開けるようにBOM付きUTF-8でCSVを保存する"""
+    write_atomic(path, df.to_csv(index=False).encode("utf-8-sig"))
+
+
+def load_state(output_dir):
+    """集計済みファイルの状態を読み込む"""
+    state_path = os.path.join(output_dir, "state.json")
+    if not os.path.exists(state_path):
+        return {"files": {}}
+    with open(state_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(output_dir, state):
+    """集計済みファイルの状態を保存する"""
+    state_path = os.path.join(output_dir, "state.json")
+    write_atomic(state_path, json.dumps(state, ensure_ascii=False, indent=2))
+
+
+def scan_directory(watch_dir, state, pending, settle_seconds, now):
+    """新規・変更されたファイルのうち、書き込みが終わったものと、削除されたファイルを返す
+
+    サイズと更新日時が settle_seconds 秒以上変わらなかったファイルだけを
+    書き込み完了とみなす。削除されたファイルは集計済み一覧から外し、その状態を返す。
+    """
+    ready = []
+    present = set()
+
+    for entry in os.scandir(watch_dir):
+        # エクセルの一時ファイル（~$で始まる）は対象外
+        if not entry.is_file() or not entry.name.endswith(".xlsx") or entry.name.startswith("~$"):
+            continue
+
+        path = os.path.abspath(entry.path)
+        stat = entry.stat()
+        signature = [stat.st_size, stat.st_mtime_ns]
+        present.add(path)
+
+        # 前回集計時からサイズ・更新日時が変わっていないファイルは対象外
+        processed = state["files"].get(path)
+        if processed is not None and processed["signature"] == signature:
+            pending.pop(path, None)
+            continue
+
+        # 初めて見つけた、または前回の確認から変化したファイルは待機
+        observed = pending.get(path)
+        if observed is None or observed["signature"] != signature:
+            pending[path] = {"signature": signature, "since": now}
+            if settle_seconds > 0:
+                continue
+            observed = pending[path]
+
+        if now - observed["since"] >= settle_seconds and time.time() - stat.st_mtime >= settle_seconds:
+            ready.append((path, signature))
+
+    # 削除されたファイルは待機対象と集計済み一覧から外す
+    for path in list(pending):
+        if path not in present:
+            del pending[path]
+    removed = {}
+    for path in list(state["files"]):
+        if path not in present:
+            removed[path] = state["files"].pop(path)
+
+    return ready, removed
+
+
+def build_overtime_frame(overtime_data):
+    """残業時間集計結果（39行目の合計）の表を作成する"""
+    df_data = []
+    for member, data in overtime_data.items():
+        row = {"メンバー": member}
+        for time_slot, time_data in data.items():
+            row[time_slot] = float(time_data["hours"])
+        df_data.append(row)
+    return pd.DataFrame(df_data)
+
+
+def find_dataset_parts(output_dir, stem):
+    """分析用データセットから指定したファイルの結果のパスを探す（全ての期間が対象）"""
+    dataset_dir = os.path.join(output_dir, "dataset")
+    if not os.path.isdir(dataset_dir):
+        return []
+
+    part_pattern = re.compile(rf"{re.escape(stem)}\.part-\d+\.parquet")
+    parts = []
+    for partition in os.scandir(dataset_dir):
+        if not partition.is_dir():
+            continue
+        for entry in os.scandir(partition.path):
+            if part_pattern.fullmatch(entry.name):
+                parts.append(entry.path)
+    return parts
+
+
+def remove_dataset_parts(output_dir, stem):
+    """分析用データセットから指定したファイルの結果を削除する"""
+    for path in find_dataset_parts(output_dir, stem):
+        os.remove(path)
+
+
+def write_dataset_part(output_dir, stem, table):
+    """分析用の結果を期間（period）ごとに分割したParquetデータセットに追加する"""
+    # 同じファイルの以前の結果は、期間が変わった場合も含めて置き換える
+    remove_dataset_parts(output_dir, stem)
+    remaining = find_dataset_parts(output_dir, stem)
+    if remaining:
+        raise RuntimeError(f"以前の分析用データを削除できませんでした: {remaining}")
+
+    ds.write_dataset(
+        table,
+        os.path.join(output_dir, "dataset"),
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("period", pa.string())]), flavor="hive"),
+        basename_template=f"{stem}.part-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore"
+    )
+
+
+def process_workbook(path, sha256, output_dir):
+    """1つのエクセルファイルを集計して結果を保存する（ワーカープロセスで実行）"""
+    workbook = openpyxl.load_workbook(path, data_only=True)
+    _, member_sheets = split_member_sheets(workbook.sheetnames)
+
+    member_data = extract_member_data(workbook, member_sheets)
+    overtime_data = member_data["overtime_data"]
+    holiday_data = member_data["holiday_data"]
+    overtime_rates = read_overtime_sheet(workbook, member_data["errors"])
+    pay_data = calculate_overtime_pay(holiday_data, overtime_rates) if overtime_rates else {}
+
+    # 同じ名前のファイルが更新された場合に備えて内容のハッシュをフォルダ名に含める
+    stem = os.path.splitext(os.path.basename(path))[0]
+    workbooks_dir = os.path.join(output_dir, "workbooks")
+    result_dir = os.path.join(workbooks_dir, f"{stem}_{sha256[:12]}")
+    os.makedirs(workbooks_dir, exist_ok=True)
+
+    # 途中で失敗した場合に結果が残らないよう、一時フォルダに書き込んでから置き換える
+    temp_dir = tempfile.mkdtemp(dir=workbooks_dir, prefix=f".{stem}_", suffix=".tmp")
+    try:
+        write_csv(os.path.join(temp_dir, "overtime.csv"), build_overtime_frame(overtime_data))
+        write_csv(os.path.join(temp_dir, "holiday.csv"), build_holiday_results_frame(holiday_data))
+        write_csv(os.path.join(temp_dir, "overtime_pay.csv"), build_overtime_pay_frame(pay_data, holiday_data))
+        write_dataset_part(output_dir, stem, build_export_table(holiday_data, pay_data, os.path.basename(path)))
+
+        summary = {
+            "workbook": os.path.basename(path),
+            "sha256": sha256,
+            "processed_at": datetime.now().isoformat(timespec="seconds"),
+            "members": len(member_sheets),
+            # 処理できなかったシート
+            "errors": member_data["errors"],
+            # 39行目の合計と日ごとの時間が一致しない時間帯
+            "mismatches": [
+                {"member": member, "time_slot": time_slot, **check}
+                for member, data in member_data["consistency"].items()
+                for time_slot, check in data.items()
+                if not check["consistent"]
+            ],
+            "total_pay": sum(
+                time_data["total_pay"] for data in pay_data.values() for time_data in data.values()
+            )
+        }
+        write_atomic(
+            os.path.join(temp_dir, "summary.json"),
+            json.dumps(summary, ensure_ascii=False, indent=2)
+        )
+
+        shutil.rmtree(result_dir, ignore_errors=True)
+        os.rename(temp_dir, result_dir)
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+    return result_dir
+
+
+def remove_results(output_dir, path, processed):
+    """ファイルの集計結果（ファイルごとの結果と分析用データセット）を削除する"""
+    if processed is not None and processed.get("result_dir"):
+        shutil.rmtree(processed["result_dir"], ignore_errors=True)
+    remove_dataset_parts(output_dir, os.path.splitext(os.path.basename(path))[0])
+
+
+def write_consolidated(output_dir, state):
+    """集計済みの全ファイルの結果をまとめて保存する"""
+    for name in ["overtime", "holiday", "overtime_pay"]:
+        frames = []
+        for path, processed in sorted(state["files"].items()):
+            if processed.get("error"):
+                continue
+            csv_path = os.path.join(processed["result_dir"], f"{name}.csv")
+            if not os.path.exists(csv_path):
+                continue
+            df = pd.read_csv(csv_path, encoding="utf-8-sig")
+            df.insert(0, "ファイル", os.path.basename(path))
+            frames.append(df)
+
+        if frames:
+            consolidated = pd.concat(frames, ignore_index=True)
+        else:
+            consolidated = pd.DataFrame()
+        write_csv(os.path.join(output_dir, f"consolidated_{name}.csv"), consolidated)
+
+
+def process_ready_files(ready, state, output_dir, executor):
+    """書き込みが終わったファイルを並列で集計し、状態を更新する"""
+    futures = {}
+
+    for path, signature in ready:
+        try:
+            sha256 = file_hash(path)
+        except OSError as e:
+            logger.warning("ファイル '%s' を読み込めませんでした: %s", path, e)
+            continue
+
+        # 更新日時だけが変わり内容が同じファイルは集計しない
+        processed = state["files"].get(path)
+        if processed is not None and processed["sha256"] == sha256 and not processed.get("error"):
+            processed["signature"] = signature
+            continue
+
+        future = executor.submit(process_workbook, path, sha256, output_dir)
+        futures[future] = (path, signature, sha256)
+
+    for future in as_completed(futures):
+        path, signature, sha256 = futures[future]
+        previous = state["files"].get(path)
+
+        try:
+            result_dir = future.result()
+        except Exception as e:
+            # 失敗したファイルは内容が変わるまで再集計しない
+            logger.error("ファイル '%s' の集計中にエラーが発生しました: %s", path, e)
+            # 以前の内容の結果はまとめた結果から外れるため、分析用データセットからも削除
+            remove_results(output_dir, path, previous)
+            state["files"][path] = {"signature": signature, "sha256": sha256, "error": str(e)}
+            continue
+
+        # 以前の内容の結果は削除
+        if previous is not None and previous.get("result_dir") not in (None, result_dir):
+            shutil.rmtree(previous["result_dir"], ignore_errors=True)
+
+        state["files"][path] = {"signature": signature, "sha256": sha256, "result_dir": result_dir}
+        logger.info("ファイル '%s' を集計しました: %s", path, result_dir)
+
+    return len(futures)
+
+
+def run(watch_dir, output_dir, interval, settle_seconds, workers, once=False):
+    """監視フォルダを定期的に確認して集計する"""
+    os.makedirs(output_dir, exist_ok=True)
+    state = load_state(output_dir)
+    pending = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            ready, removed_files = scan_directory(
+                watch_dir, state, pending, 0 if once else settle_seconds, time.monotonic()
+            )
+            processed_count = process_ready_files(ready, state, output_dir, executor)
+
+            # 削除されたファイルの結果を削除
+            for path, processed in removed_files.items():
+                remove_results(output_dir, path, processed)
+                logger.info("ファイル '%s' が削除されたため集計結果を削除しました", path)
+
+            # 集計結果が変わった場合のみ保存
+            if ready or removed_files:
+                save_state(output_dir, state)
+            if processed_count or removed_files:
+                write_consolidated(output_dir, state)
+
+            if once:
+                break
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = parse_args()
+    run(args.watch_dir, args.output_dir, args.interval, args.settle, args.workers, once=args.once)
@@ -0,0 +1,289 @@
+"""アプリの同時アクセス負荷試験
+
+使い方:
+    python loadtest.py --sessions 8 --sizes 10,50,200 --rounds 3 --output loadtest_report.json
+
+Streamlitのテスト機能（AppTest）で main() を画面なしで実行し、生成したエクセルファイルを
+両タブにアップロードしたセッションを同時に複数実行する。サイズ（メンバー数）ごとの
+応答時間（p50/p95/p99）、スループット、プロセスごとのメモリ使用量をJSONで出力する。
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import openpyxl
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args():
+    """コマンドライン引数を読み込む"""
+    parser = argparse.ArgumentParser(description="アプリの同時アクセス負荷試験")
+    parser.add_argument("--sessions", type=int, default=4, help="1プロセスあたりの同時セッション数")
+    parser.add_argument("--processes", type=int, default=1, help="アプリを実行するプロセス数")
+    parser.add_argument("--sizes", default="10,50,200", help="ファイルのメンバー数（カンマ区切り）")
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=3,
+        help="各セッションがアップロードする回数（毎回内容の異なるファイル）"
+    )
+    parser.add_argument(
+        "--same-file",
+        action="store_true",
+        help="全セッションで同じ内容のファイルを使う（キャッシュが効く場合を測定）"
+    )
+    parser.add_argument("--output", default="loadtest_report.json", help="結果を保存するJSONファイル")
+    return parser.parse_args()
+
+
+def make_workbook(member_count, seed, month_start=datetime(2024, 10, 1)):
+    """テスト用のエクセルファイルを作成する（アップロードされる形式と同じシート構成）"""
+    rnd = random.Random(seed)
+    workbook = openpyxl.Workbook()
+    workbook.active.title = "まとめ"
+    workbook.create_sheet("記入例")
+    workbook.create_sheet("報告書format")
+
+    # 残業代シート（C30から名前とD〜G列の単価）
+    rate_sheet = workbook.create_sheet("残業代")
+    for index in range(member_count):
+        row = 30 + index
+        rate_sheet[f"C{row}"] = f"メンバー{index:04d} 太郎"
+        rate_sheet[f"D{row}"] = 1000 + rnd.randrange(0, 500, 10)
+        rate_sheet[f"E{row}"] = 1250 + rnd.randrange(0, 500, 10)
+        rate_sheet[f"F{row}"] = 1350 + rnd.randrange(0, 500, 10)
+        rate_sheet[f"G{row}"] = 1600 + rnd.randrange(0, 500, 10)
+
+    # メンバーシート（B列に日付、C列に祝日、K/O/S/W列に時間、39行目に合計）
+    for index in range(member_count):
+        worksheet = workbook.create_sheet(f"メンバー{index:04d}")
+        totals = {column: 0 for column in "KOSW"}
+
+        for day in range(31):
+            row = 8 + day
+            worksheet[f"B{row}"] = month_start + timedelta(days=day)
+            if rnd.random() < 0.05:
+                worksheet[f"C{row}"] = "祝日"
+
+            for column in "KOSW":
+                if rnd.random() < 0.3:
+                    minutes = rnd.choice([30, 60, 90, 120, 180])
+                    worksheet[f"{column}{row}"] = minutes / 1440  # エクセルの時間値（1日=1.0）
+                    totals[column] += minutes
+
+        for column, minutes in totals.items():
+            if minutes:
+                worksheet[f"{column}39"] = minutes / 1440
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def session_script():
+    """1セッション分のアプリの実行（AppTestが別ファイルとして実行する）"""
+    import app
+
+    app.main()
+
+
+def install_uploader():
+    """file_uploaderを、セッションに設定したファイルを返すものに置き換える
+
+    AppTestはファイルのアップロードを操作できないため、アップロード済みの状態を再現する。
+    """
+    import streamlit as st
+
+    class UploadedWorkbook(io.BytesIO):
+        """アップロードされたファイルの代わり（nameとgetvalueを持つ）"""
+
+        def __init__(self, data, name):
+            super().__init__(data)
+            self.name = name
+
+    def file_uploader(label, *args, **kwargs):
+        upload = st.session_state.get("loadtest_upload")
+        if upload is None:
+            return None
+        return UploadedWorkbook(upload["data"], upload["name"])
+
+    st.file_uploader = file_uploader
+
+
+def current_rss_bytes():
+    """現在のメモリ使用量（RSS）をバイト数で返す（取得できない場合はNone）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_bytes():
+    """最大メモリ使用量（RSS）をバイト数で返す"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、Linuxはキロバイト単位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_session(workbooks, name):
+    """1セッションでファイルを1つずつアップロードし、1回ごとの応答時間を返す"""
+    from streamlit.testing.v1 import AppTest
+
+    latencies = []
+    errors = []
+    for workbook in workbooks:
+        app_test = AppTest.from_function(session_script, default_timeout=600)
+        app_test.session_state["loadtest_upload"] = {"data": workbook, "name": name}
+
+        started = time.perf_counter()
+        app_test.run()
+        latencies.append(time.perf_counter() - started)
+
+        # 例外やエラー表示があった場合は記録
+        messages = [element.value for element in app_test.exception]
+        messages += [element.value for element in app_test.error]
+        errors.extend(str(message) for message in messages)
+
+    return latencies, errors
+
+
+def run_process(process_index, sessions, sizes, rounds, same_file, cache_dir):
+    """1プロセス分の負荷試験（サイズごとにセッションを同時実行する）"""
+    # 試験ごとに空のキャッシュから開始
+    os.environ["RESULT_CACHE_DIR"] = cache_dir
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    install_uploader()
+
+    # appの読み込みなど初回だけの処理を計測に含めないよう、計測前に1回実行する
+    run_session([make_workbook(1, seed=f"warmup-{process_index}")], "loadtest_warmup.xlsx")
+
+    results = []
+    for member_count in sizes:
+        # 毎回内容の異なるファイルをアップロードする（キャッシュが効かない状態）
+        # --same-fileの場合は全セッション・全回で同じファイル
+        if same_file:
+            workbook = make_workbook(member_count, seed=0)
+            workbooks = [[workbook] * rounds for _ in range(sessions)]
+        else:
+            workbooks = [
+                [
+                    make_workbook(member_count, seed=f"{process_index}-{session}-{round_index}-{member_count}")
+                    for round_index in range(rounds)
+                ]
+                for session in range(sessions)
+            ]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            futures = [
+                executor.submit(run_session, session_workbooks, f"loadtest_{member_count}_{session}.xlsx")
+                for session, session_workbooks in enumerate(workbooks)
+            ]
+            session_results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - started
+
+        results.append({
+            "members": member_count,
+            "workbook_bytes": len(workbooks[0][0]),
+            "latencies": [latency for latencies, _ in session_results for latency in latencies],
+            "errors": [error for _, errors in session_results for error in errors],
+            "elapsed": elapsed,
+            "rss_bytes": current_rss_bytes()
+        })
+
+    return {
+        "process": process_index,
+        "pid": os.getpid(),
+        "results": results,
+        "peak_rss_bytes": peak_rss_bytes()
+    }
+
+
+def summarize(process_results, sizes):
+    """プロセスごとの結果をサイズごとにまとめる"""
+    summary = []
+    for size_index, member_count in enumerate(sizes):
+        size_results = [process["results"][size_index] for process in process_results]
+        latencies = np.array([latency for result in size_results for latency in result["latencies"]])
+        errors = [error for result in size_results for error in result["errors"]]
+        elapsed = max(result["elapsed"] for result in size_results)
+
+        summary.append({
+            "members": member_count,
+            "workbook_bytes": size_results[0]["workbook_bytes"],
+            "requests": int(latencies.size),
+            "errors": len(errors),
+            "error_samples": errors[:5],
+            "latency_seconds": {
+                "p50": float(np.percentile(latencies, 50)),
+                "p95": float(np.percentile(latencies, 95)),
+                "p99": float(np.percentile(latencies, 99)),
+                "max": float(latencies.max())
+            },
+            "throughput_per_second": latencies.size / elapsed if elapsed > 0 else None,
+            "rss_bytes": {
+                str(process["pid"]): process["results"][size_index]["rss_bytes"]
+                for process in process_results
+            }
+        })
+    return summary
+
+
+def main():
+    args = parse_args()
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            futures = [
+                executor.submit(
+                    run_process, process_index, args.sessions, sizes, args.rounds, args.same_file, cache_dir
+                )
+                for process_index in range(args.processes)
+            ]
+            process_results = [future.result() for future in futures]
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "processes": args.processes,
+            "sessions_per_process": args.sessions,
+            "sizes": sizes,
+            "rounds": args.rounds,
+            "same_file": args.same_file,
+            "cpu_count": os.cpu_count()
+        },
+        "sizes": summarize(process_results, sizes),
+        "processes": [
+            {"pid": process["pid"], "peak_rss_bytes": process["peak_rss_bytes"]}
+            for process in process_results
+        ]
+    }
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for size in report["sizes"]:
+        latency = size["latency_seconds"]
+        print(
+            f"メンバー数 {size['members']}: "
+            f"p50 {latency['p50']:.2f}s / p95 {latency['p95']:.2f}s / p99 {latency['p99']:.2f}s, "
+            f"{size['throughput_per_second']:.2f}件/秒, エラー {size['errors']}件"
+        )
+    print(f"結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
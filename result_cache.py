@@ -0,0 +1,195 @@
+"""エクセルファイルの集計結果をディスクに保存し、複数のプロセスで共有するキャッシュ
+
+ファイル内容のハッシュと抽出処理のバージョンをキーにするため、同じファイルが
+どのプロセスにアップロードされても、2回目以降は保存済みの結果を返す。
+
+設定（環境変数）:
+    RESULT_CACHE_DIR        キャッシュを保存するフォルダ（既定: ~/.cache/t_kento/result_cache）
+    RESULT_CACHE_MAX_BYTES  キャッシュ全体の上限サイズ（既定: 512MB）
+    RESULT_CACHE_MAX_AGE    保存した結果を残す秒数（既定: 7日）
+
+キャッシュの読み書きに失敗した場合（フォルダに書き込めない、ディスクの空きがないなど）は
+キャッシュを使わずに計算した結果を返す。
+"""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windowsではロックなし（結果の書き込みは置き換えで行うため途中の内容は読まれない）
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def cache_dir():
+    """キャッシュを保存するフォルダ（既定はユーザーごとのキャッシュフォルダ）"""
+    user_cache_dir = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.environ.get("RESULT_CACHE_DIR", os.path.join(user_cache_dir, "t_kento", "result_cache"))
+
+
+def is_safe_cache_dir(path):
+    """キャッシュフォルダを作成し、自分以外のユーザーが書き込めないことを確認する
+
+    保存した結果はpickleで読み込むため、他のユーザーが置いたファイルは読み込まない。
+    フォルダを作成できない場合もFalseを返す。
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        if not hasattr(os, "getuid"):
+            return True
+        stat = os.stat(path)
+    except OSError as e:
+        logger.warning("キャッシュフォルダ '%s' を使用できません: %s", path, e)
+        return False
+
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+        logger.warning("キャッシュフォルダ '%s' は他のユーザーが書き込めるため使用しません", path)
+        return False
+    return True
+
+
+def make_key(file_bytes, version):
+    """ファイル内容と抽出処理のバージョンからキーを作成する"""
+    return f"{hashlib.sha256(file_bytes).hexdigest()}-v{version}"
+
+
+def entry_path(key):
+    """キーに対応する保存先のパス"""
+    return os.path.join(cache_dir(), "objects", key[:2], f"{key}.pkl")
+
+
+@contextmanager
+def file_lock(name):
+    """プロセス間で排他するためのロックを取得する（取得できない場合はロックなしで続ける）"""
+    lock_dir = os.path.join(cache_dir(), "locks")
+    lock_file = None
+    try:
+        os.makedirs(lock_dir, exist_ok=True)
+        lock_file = open(os.path.join(lock_dir, f"{name}.lock"), "a")
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+    except OSError as e:
+        # ロックは同じ結果の重複した計算を防ぐためだけなので、取得できなくても処理は続ける
+        logger.warning("キャッシュのロックを取得できませんでした: %s", e)
+        if lock_file is not None:
+            lock_file.close()
+            lock_file = None
+
+    try:
+        yield
+    finally:
+        # ファイルを閉じるとロックも解除される
+        if lock_file is not None:
+            lock_file.close()
+
+
+def load(key):
+    """保存済みの結果を読み込む（ない場合はNone）"""
+    path = entry_path(key)
+    try:
+        with open(path, "rb") as f:
+            result = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # 壊れた結果やライブラリの更新で読み込めなくなった結果は削除して再計算させる
+        remove_file(path)
+        return None
+
+    # 最近使った結果を削除対象から外すため更新日時を更新
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return result
+
+
+def store(key, result):
+    """結果を保存する（一時ファイルに書き込んでから置き換える、失敗した場合は保存しない）"""
+    path = entry_path(key)
+    temp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+            temp_path = f.name
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        evict()
+    except Exception as e:
+        # 計算は終わっているため、保存できなくても結果はそのまま返す
+        logger.warning("結果をキャッシュに保存できませんでした: %s", e)
+        if temp_path is not None:
+            remove_file(temp_path)
+
+
+def evict():
+    """古い結果と、上限サイズを超えた分の使われていない結果を削除する"""
+    max_bytes = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+    max_age = float(os.environ.get("RESULT_CACHE_MAX_AGE", 7 * 24 * 60 * 60))
+    objects_dir = os.path.join(cache_dir(), "objects")
+
+    with file_lock("evict"):
+        now = time.time()
+        entries = []
+
+        for root, _, files in os.walk(objects_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                # 書き込み途中で残った一時ファイルは1時間経過したら削除
+                is_stale_temp = name.endswith(".tmp") and now - stat.st_mtime > 60 * 60
+                if is_stale_temp or (name.endswith(".pkl") and now - stat.st_mtime > max_age):
+                    remove_file(path)
+                elif name.endswith(".pkl"):
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        # 上限サイズを超えている場合は使われていない順に削除
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= max_bytes:
+                break
+            remove_file(path)
+            total_bytes -= size
+
+
+def remove_file(path):
+    """ファイルを削除する（他のプロセスが削除済みの場合は無視）"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def get_or_compute(key, compute):
+    """保存済みの結果を返し、ない場合は計算して保存する
+
+    同じキーを複数のプロセスが同時に計算しないように、計算中はロックを取得する。
+    """
+    if not is_safe_cache_dir(cache_dir()):
+        # 使用できないフォルダや他のユーザーが書き込めるフォルダは使わずに計算する
+        return compute()
+
+    result = load(key)
+    if result is not None:
+        return result
+
+    # ロックファイルが増えすぎないよう、キーの先頭2文字ごとに共有する
+    with file_lock(key[:2]):
+        # ロック待ちの間に他のプロセスが保存した場合はその結果を使う
+        result = load(key)
+        if result is None:
+            result = compute()
+            store(key, result)
+
+    return result
@@ -0,0 +1,103 @@
+from datetime import date, datetime
+
+import openpyxl
+import pandas as pd
+
+import app
+
+SLOT_EVENING = '平日・休日時間外の応動（18:00-22:00）'
+SLOT_MORNING = '平日・休日時間外の応動（05:00-09:00）'
+
+
+def make_slot(days):
+    """日ごとの(日付, 休日かどうか, 時間)から休日・平日仕訳データを作成する"""
+    holiday_hours = 0
+    weekday_hours = 0
+    for _, is_holiday, hours in days:
+        if is_holiday:
+            holiday_hours += hours
+        else:
+            weekday_hours += hours
+    return {
+        'holiday_hours': holiday_hours,
+        'weekday_hours': weekday_hours,
+        'total_hours': holiday_hours + weekday_hours,
+        'daily': [
+            {'date': day, 'is_holiday': is_holiday, 'hours': hours}
+            for day, is_holiday, hours in days
+        ]
+    }
+
+
+def make_rates(rate_rows):
+    """(適用開始日, D列の単価)の行から単価表を作成する"""
+    return app.build_rate_table([
+        {'start': start, 'D': rate, 'E': rate, 'F': rate, 'G': rate}
+        for start, rate in rate_rows
+    ])
+
+
+def test_mid_month_rate_change_for_every_member():
+    members = ['A', 'B', 'C']
+    holiday_data = {
+        member: {SLOT_EVENING: make_slot([(date(2024, 10, 10), False, 1.0), (date(2024, 10, 20), False, 2.0)])}
+        for member in members
+    }
+    # 稼働のないメンバーが先頭にいても後続のメンバーの単価がずれないこと
+    holiday_data = {'Z': {SLOT_EVENING: make_slot([])}, **holiday_data}
+    overtime_rates = {
+        f"{member} 太郎": make_rates([(None, 1000 * (index + 1)), (date(2024, 10, 16), 2000 * (index + 1))])
+        for index, member in enumerate(members)
+    }
+    overtime_rates = {'Z 太郎': make_rates([(None, 500), (date(2024, 10, 16), 600)]), **overtime_rates}
+
+    pay_data = app.calculate_overtime_pay(holiday_data, overtime_rates)
+
+    # 10/10は変更前の単価、10/20は10/16からの単価
+    for index, member in enumerate(members):
+        expected = 1.0 * 1000 * (index + 1) + 2.0 * 2000 * (index + 1)
+        assert pay_data[member][SLOT_EVENING]['weekday_pay'] == expected
+
+
+def test_lookup_rate_rows_keeps_member_segments_sorted():
+    rate_table = make_rates([(None, 1000), (date(2024, 10, 16), 2000)])
+
+    rows = app.lookup_rate_rows(
+        [rate_table, rate_table, rate_table],
+        [0, 1, 2, 2],
+        [date(2024, 10, 20), date(2024, 10, 1), date(2024, 10, 16), None]
+    )
+
+    assert list(rows) == [1, 0, 1, 0]
+
+
+def test_single_rate_pay_matches_previous_totals():
+    # 抽出時の時間は浮動小数点の誤差を含む（合計すると8:00、まとめて足すと7:59になる並び）
+    weekday_hours = [2.0, 0.9999999999999998, 2.0, 0.4999999999999999, 2.0, 0.4999999999999999]
+    holiday_data = {
+        'A': {SLOT_MORNING: make_slot([(date(2024, 10, 1 + index), False, hours) for index, hours in enumerate(weekday_hours)])}
+    }
+    overtime_rates = {'A 太郎': make_rates([(None, 1340)])}
+
+    pay_data = app.calculate_overtime_pay(holiday_data, overtime_rates)
+
+    assert pay_data['A'][SLOT_MORNING]['weekday_pay'] == 8.0 * 1340
+
+
+def test_invalid_effective_dates_are_treated_as_undated():
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.create_sheet("残業代")
+    # 日付セル以外の値と扱えない範囲の日付は適用開始日なしとして読み込む
+    cells = [(None, 1000), (150000, 1100), (3000, 1200), (datetime(1500, 1, 1), 1300), (datetime(2024, 10, 16), 2000)]
+    for index, (start, rate) in enumerate(cells):
+        row = 30 + index
+        worksheet[f"C{row}"] = f"{chr(ord('A') + index)} 太郎"
+        worksheet[f"D{row}"] = rate
+        worksheet[f"H{row}"] = start
+    errors = []
+
+    overtime_rates = app.read_overtime_sheet(workbook, errors)
+
+    assert [rates.index.left[0] for rates in overtime_rates.values()][:4] == [pd.Timestamp.min] * 4
+    assert overtime_rates['E 太郎'].index.left[0] == pd.Timestamp(2024, 10, 16)
+    assert [message.split()[1] for message in errors] == ['H31', 'H32', 'H33']
@@ -0,0 +1,123 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ingest
+from loadtest import make_workbook
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    watch_dir = tmp_path / "in"
+    output_dir = tmp_path / "out"
+    watch_dir.mkdir()
+    return str(watch_dir), str(output_dir)
+
+
+def write_workbook(watch_dir, name, seed, age=60):
+    """監視フォルダにエクセルファイルを作成する（age秒前に更新されたものとする）"""
+    path = os.path.abspath(os.path.join(watch_dir, name))
+    with open(path, "wb") as f:
+        f.write(make_workbook(3, seed=seed))
+    touch(path, age)
+    return path
+
+
+def touch(path, age):
+    """ファイルの更新日時をage秒前にする"""
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def run_once(watch_dir, output_dir):
+    ingest.run(watch_dir, output_dir, interval=0, settle_seconds=0, workers=1, once=True)
+    return ingest.load_state(output_dir)
+
+
+def test_file_is_processed_after_it_settles(dirs):
+    watch_dir, _ = dirs
+    path = write_workbook(watch_dir, "a.xlsx", seed=1, age=60)
+    state = {"files": {}}
+    pending = {}
+
+    # 初めて見つけたファイルと、待機時間が経過していないファイルは対象外
+    assert ingest.scan_directory(watch_dir, state, pending, 30, now=0) == ([], {})
+    assert ingest.scan_directory(watch_dir, state, pending, 30, now=29) == ([], {})
+
+    # 書き込みが続くと待機をやり直す
+    with open(path, "ab") as f:
+        f.write(b"\0")
+    touch(path, 60)
+    assert ingest.scan_directory(watch_dir, state, pending, 30, now=31) == ([], {})
+
+    ready, removed = ingest.scan_directory(watch_dir, state, pending, 30, now=61)
+    assert [ready_path for ready_path, _ in ready] == [path]
+    assert removed == {}
+
+
+def test_touched_file_with_same_content_is_not_reprocessed(dirs):
+    watch_dir, output_dir = dirs
+    path = write_workbook(watch_dir, "a.xlsx", seed=1)
+    state = run_once(watch_dir, output_dir)
+    result_dir = state["files"][path]["result_dir"]
+
+    # 更新日時だけを変更
+    touch(path, 30)
+    ready, _ = ingest.scan_directory(watch_dir, state, {}, 0, time.monotonic())
+    assert [ready_path for ready_path, _ in ready] == [path]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert ingest.process_ready_files(ready, state, output_dir, executor) == 0
+
+    assert state["files"][path]["result_dir"] == result_dir
+    assert state["files"][path]["signature"] == ready[0][1]
+    assert os.path.isdir(result_dir)
+
+
+def test_deleted_file_removes_results(dirs):
+    watch_dir, output_dir = dirs
+    path = write_workbook(watch_dir, "a.xlsx", seed=1)
+    result_dir = run_once(watch_dir, output_dir)["files"][path]["result_dir"]
+    assert os.path.exists(os.path.join(result_dir, "holiday.csv"))
+    assert ingest.find_dataset_parts(output_dir, "a")
+
+    os.remove(path)
+    state = run_once(watch_dir, output_dir)
+
+    assert state["files"] == {}
+    assert not os.path.exists(result_dir)
+    assert ingest.find_dataset_parts(output_dir, "a") == []
+    with open(os.path.join(output_dir, "consolidated_holiday.csv"), encoding="utf-8-sig") as f:
+        assert f.read().strip() == ""
+
+
+def test_failed_reprocess_drops_previous_results(dirs):
+    watch_dir, output_dir = dirs
+    path = write_workbook(watch_dir, "a.xlsx", seed=1)
+    result_dir = run_once(watch_dir, output_dir)["files"][path]["result_dir"]
+
+    # 読み込めない内容に置き換え
+    with open(path, "wb") as f:
+        f.write(b"broken")
+    touch(path, 30)
+    state = run_once(watch_dir, output_dir)
+
+    assert state["files"][path]["error"]
+    assert not os.path.exists(result_dir)
+    assert ingest.find_dataset_parts(output_dir, "a") == []
+
+
+def test_failed_write_leaves_no_result_directory(dirs, monkeypatch):
+    watch_dir, output_dir = dirs
+    path = write_workbook(watch_dir, "a.xlsx", seed=1)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("書き込みに失敗しました")
+
+    monkeypatch.setattr(ingest, "write_dataset_part", fail)
+    with pytest.raises(RuntimeError):
+        ingest.process_workbook(path, ingest.file_hash(path), output_dir)
+
+    assert os.listdir(os.path.join(output_dir, "workbooks")) == []
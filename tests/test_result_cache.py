@@ -0,0 +1,125 @@
+import os
+import pickle
+import time
+
+import pytest
+
+import result_cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    path = tmp_path / "cache"
+    monkeypatch.setenv("RESULT_CACHE_DIR", str(path))
+    return path
+
+
+def compute_counter(value):
+    """呼び出し回数を記録しながらvalueを返す計算"""
+    calls = []
+
+    def compute():
+        calls.append(value)
+        return value
+
+    return compute, calls
+
+
+def set_age(path, age):
+    """ファイルの更新日時をage秒前にする"""
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def test_store_and_load(cache_dir):
+    key = result_cache.make_key(b"workbook", 1)
+    assert result_cache.load(key) is None
+
+    result_cache.store(key, {"members": ["A", "B"]})
+
+    assert result_cache.load(key) == {"members": ["A", "B"]}
+    # 書き込み用の一時ファイルは残らない
+    entry_dir = os.path.dirname(result_cache.entry_path(key))
+    assert os.listdir(entry_dir) == [os.path.basename(result_cache.entry_path(key))]
+
+
+def test_get_or_compute_reuses_stored_result(cache_dir):
+    key = result_cache.make_key(b"workbook", 1)
+    compute, calls = compute_counter({"members": ["A"]})
+
+    assert result_cache.get_or_compute(key, compute) == {"members": ["A"]}
+    assert result_cache.get_or_compute(key, compute) == {"members": ["A"]}
+    assert len(calls) == 1
+
+    # バージョンが変わると再計算する
+    result_cache.get_or_compute(result_cache.make_key(b"workbook", 2), compute)
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("content", [
+    b"not a pickle",
+    # 存在しないモジュールのクラス（ライブラリの更新で読み込めなくなった結果）
+    b"cmissing_module\nMissing\n.",
+])
+def test_unreadable_entry_is_recomputed(cache_dir, content):
+    key = result_cache.make_key(b"workbook", 1)
+    path = result_cache.entry_path(key)
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(content)
+    compute, calls = compute_counter({"members": ["A"]})
+
+    assert result_cache.get_or_compute(key, compute) == {"members": ["A"]}
+    assert len(calls) == 1
+    with open(path, "rb") as f:
+        assert pickle.load(f) == {"members": ["A"]}
+
+
+def test_unsafe_cache_dir_is_not_used(cache_dir):
+    os.makedirs(cache_dir)
+    os.chmod(cache_dir, 0o777)
+    key = result_cache.make_key(b"workbook", 1)
+    compute, calls = compute_counter({"members": ["A"]})
+
+    assert not result_cache.is_safe_cache_dir(str(cache_dir))
+    assert result_cache.get_or_compute(key, compute) == {"members": ["A"]}
+    assert result_cache.get_or_compute(key, compute) == {"members": ["A"]}
+    assert len(calls) == 2
+    assert os.listdir(cache_dir) == []
+
+
+def test_cache_dir_that_cannot_be_created_falls_back_to_compute(tmp_path, monkeypatch):
+    (tmp_path / "file").write_bytes(b"")
+    monkeypatch.setenv("RESULT_CACHE_DIR", str(tmp_path / "file" / "cache"))
+    compute, calls = compute_counter({"members": ["A"]})
+
+    assert result_cache.get_or_compute(result_cache.make_key(b"workbook", 1), compute) == {"members": ["A"]}
+    assert len(calls) == 1
+
+
+def test_store_failure_returns_computed_result(cache_dir):
+    # 結果の保存先にフォルダを作成できない状態
+    os.makedirs(cache_dir)
+    (cache_dir / "objects").write_bytes(b"")
+    key = result_cache.make_key(b"workbook", 1)
+    compute, calls = compute_counter({"members": ["A"]})
+
+    assert result_cache.get_or_compute(key, compute) == {"members": ["A"]}
+    assert result_cache.load(key) is None
+
+
+def test_evict_removes_old_and_least_recently_used_entries(cache_dir, monkeypatch):
+    keys = [result_cache.make_key(f"workbook{index}".encode(), 1) for index in range(4)]
+    for key in keys:
+        result_cache.store(key, b"x" * 1000)
+    entry_size = os.path.getsize(result_cache.entry_path(keys[0]))
+
+    # keys[0]は期限切れ、残りはkeys[1]が最も使われていない
+    for key, age in zip(keys, [400, 30, 20, 10]):
+        set_age(result_cache.entry_path(key), age)
+    monkeypatch.setenv("RESULT_CACHE_MAX_AGE", "300")
+    monkeypatch.setenv("RESULT_CACHE_MAX_BYTES", str(entry_size * 2))
+
+    result_cache.evict()
+
+    assert [os.path.exists(result_cache.entry_path(key)) for key in keys] == [False, False, True, True]